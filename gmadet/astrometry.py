@@ -15,9 +15,10 @@ import subprocess
 import sys
 import os
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from astropy.io import fits
-from gmadet.utils import (mv_p, mkdir_p, cp_p, getpath)
-import xmltodict
+from gmadet.utils import (mv_p, mkdir_p, cp_p, getpath, get_header,
+                          get_pixscale, get_xml_fields)
 
 
 def clean_tmp_files(filename, soft="scamp"):
@@ -25,19 +26,19 @@ def clean_tmp_files(filename, soft="scamp"):
 
     fileroot = os.path.splitext(filename)[0]
     if soft == "astrometrynet":
-        os.remove(fileroot[0] + "-indx.xyls")
-        os.remove(fileroot[0] + ".axy")
-        os.remove(fileroot[0] + ".corr")
-        os.remove(fileroot[0] + ".match")
-        os.remove(fileroot[0] + ".rdls")
-        os.remove(fileroot[0] + ".solved")
-        os.remove(fileroot[0] + ".wcs")
-        os.remove(fileroot[0] + ".fits")
-        os.rename(fileroot[0] + ".new", fileroot[0] + ".fits")
+        os.remove(fileroot + "-indx.xyls")
+        os.remove(fileroot + ".axy")
+        os.remove(fileroot + ".corr")
+        os.remove(fileroot + ".match")
+        os.remove(fileroot + ".rdls")
+        os.remove(fileroot + ".solved")
+        os.remove(fileroot + ".wcs")
+        os.remove(fileroot + ".fits")
+        os.rename(fileroot + ".new", fileroot + ".fits")
     elif soft == "scamp":
-        os.remove("prepscamp.cat")
-        os.remove("prepscamp.head")
-        os.remove("scamp.xml")
+        os.remove(fileroot + "_prepscamp.cat")
+        os.remove(fileroot + "_prepscamp.head")
+        os.remove(fileroot + "_scamp.xml")
 
 
 def remove_astro_keywords(header):
@@ -178,128 +179,159 @@ def astrometrynet(filename, radius=4, scaleLow=3.5, scaleHigh=4,
     clean_tmp_files(filename, soft="astrometrynet")
 
 
+def _scamp_one(ima, config, accuracy=0.5, itermax=10,
+               band=None, CheckPlot=False, verbose="NORMAL"):
+    """Run scamp iteratively on a single image until the required
+    astrometric accuracy is reached"""
+
+    print("Performing astrometric calibration on %s using SCAMP." % ima)
+    # print ('You required astrometric precision of %.3f arcsec.' % accuracy)
+
+    root = os.path.splitext(ima)[0]
+    _name = root.split("/")[-1]
+
+    # Temporary files are named after the image, so that several
+    # images can be calibrated at the same time.
+    catname = root + "_prepscamp.cat"
+    headname = root + "_prepscamp.head"
+    xmlname = root + "_scamp.xml"
+
+    if CheckPlot:
+        plot_fmt = "PNG"
+        plotnames = (
+            "%s_fgroups,%s_distort,%s_astr_interror2d,%s_astr_interror1d,%s_astr_referror2d,%s_astr_referror1d,%s_astr_chi2,%s_psphot_error"
+            % (root, root, root, root, root, root, root, root)
+        )
+        plottypes = "FGROUPS,DISTORTION,ASTR_INTERROR2D,ASTR_INTERROR1D,ASTR_REFERROR2D,ASTR_REFERROR1D,ASTR_CHI2,PHOT_ERROR"
+    else:
+        plot_fmt = "NULL"
+        plotnames = " "
+        plottypes = " "
+
+    if config["telescope"] == "PS1" and band is not None:
+        astref_band = band
+    else:
+        astref_band = "DEFAULT"
+
+    #  Initialise the while loop
+    i = 0
+    #  Dummy offset
+    mean_offset = 100
+    while (mean_offset >= accuracy) and (i <= itermax):
+        i += 1
+        #  Create catalog using sextractor
+        # print ('Create FITS-LDAC file from SExtractor')
+        subprocess.call(
+            [
+                "sex",
+                "-c", config["scamp"]["sextractor"],
+                "-PARAMETERS_NAME", config["scamp"]["param"],
+                "-VERBOSE_TYPE", verbose,
+                "-FILTER_NAME", config['sextractor']['convFilter'],
+                "-CATALOG_NAME", catname,
+                ima,
+            ]
+        )
+        #  Run SCAMP
+        subprocess.call(
+            [
+                "scamp",
+                catname,
+                "-c", config["scamp"]["conf"],
+                "-ASTREF_BAND", astref_band,
+                "-CHECKPLOT_DEV", plot_fmt,
+                "-CHECKPLOT_NAME", plotnames,
+                "-CHECKPLOT_TYPE", plottypes,
+                "-VERBOSE_TYPE", verbose,
+                "-XML_NAME", xmlname,
+            ]
+        )
+        #  Check astrometry offset
+        xml_fields = get_xml_fields(xmlname)
+        """
+        offset = doc['VOTABLE']['RESOURCE']['RESOURCE']['TABLE'][0]['DATA']['TABLEDATA']['TR']['TD'][34]
+        offset = offset.split(' ')
+        offset_axis1 = float(offset[0])
+        offset_axis2 = float(offset[1])
+        """
+        header = header_from_string(headname)
+        offset_axis1 = float(header["ASTRRMS1"] * 3600)
+        offset_axis2 = float(header["ASTRRMS2"] * 3600)
+
+        mean_offset = np.mean([offset_axis1, offset_axis2])
+        print(
+            "Astrometric precision after run %d: %.2f arcseconds. Required: %.2f."
+            % (i, mean_offset, accuracy)
+        )
+
+        pixelscale = xml_fields[18].split("  ")
+        pixelscale = [float(pixelscale[0]) / 3600,
+                      float(pixelscale[1]) / 3600]
+        # Update header of input fits file
+        update_headers_scamp(ima, headname, pixelscale)
+    # cp_p(catname, _name.split('.')[0]+'.cat')
+    #  Delete temporary files
+    clean_tmp_files(ima, soft="scamp")
+
+
 def scamp(filename, config, accuracy=0.5, itermax=10,
           band=None, useweight=False, CheckPlot=False,
           verbose="NORMAL"):
     """Compute astrometric solution of astronomical image using scamp"""
-    
-    path = os.path.dirname(filename)
+
     imagelist = np.atleast_1d(filename)
     for ima in imagelist:
-        print("Performing astrometric calibration on %s using SCAMP." % ima)
-        # print ('You required astrometric precision of %.3f arcsec.' % accuracy)
+        _scamp_one(ima, config, accuracy=accuracy, itermax=itermax,
+                   band=band, CheckPlot=CheckPlot, verbose=verbose)
+    print("\n")
 
-        root = os.path.splitext(ima)[0]
-        _name = root.split("/")[-1]
 
-        if CheckPlot:
-            plot_fmt = "PNG"
-            plotnames = (
-                "%s_fgroups,%s_distort,%s_astr_interror2d,%s_astr_interror1d,%s_astr_referror2d,%s_astr_referror1d,%s_astr_chi2,%s_psphot_error"
-                % (root, root, root, root, root, root, root, root)
-            )
-            plottypes = "FGROUPS,DISTORTION,ASTR_INTERROR2D,ASTR_INTERROR1D,ASTR_REFERROR2D,ASTR_REFERROR1D,ASTR_CHI2,PHOT_ERROR"
-        else:
-            plot_fmt = "NULL"
-            plotnames = " "
-            plottypes = " "
-
-        if config["telescope"] == "PS1" and band is not None:
-            astref_band = band
-        else:
-            astref_band = "DEFAULT"
-
-        #  Initialise the while loop
-        i = 0
-        #  Dummy offset
-        mean_offset = 100
-        while (mean_offset >= accuracy) and (i <= itermax):
-            i += 1
-            #  Create catalog using sextractor
-            # print ('Create FITS-LDAC file from SExtractor')
-            subprocess.call(
-                [
-                    "sex",
-                    "-c", config["scamp"]["sextractor"],
-                    "-PARAMETERS_NAME", config["scamp"]["param"],
-                    "-VERBOSE_TYPE", verbose,
-                    "-FILTER_NAME", config['sextractor']['convFilter'],
-                    ima,
-                ]
-            )
-            #  Run SCAMP
-            subprocess.call(
-                [
-                    "scamp",
-                    "prepscamp.cat",
-                    "-c", config["scamp"]["conf"],
-                    "-ASTREF_BAND", astref_band,
-                    "-CHECKPLOT_DEV", plot_fmt,
-                    "-CHECKPLOT_NAME", plotnames,
-                    "-CHECKPLOT_TYPE", plottypes,
-                    "-VERBOSE_TYPE", verbose,
-                ]
-            )
-            #  Check astrometry offset
-            with open("scamp.xml") as fd:
-                doc = xmltodict.parse(fd.read())
-            """
-            offset = doc['VOTABLE']['RESOURCE']['RESOURCE']['TABLE'][0]['DATA']['TABLEDATA']['TR']['TD'][34]
-            offset = offset.split(' ')
-            offset_axis1 = float(offset[0])
-            offset_axis2 = float(offset[1])
-            """
-            header = header_from_string("prepscamp.head")
-            offset_axis1 = float(header["ASTRRMS1"] * 3600)
-            offset_axis2 = float(header["ASTRRMS2"] * 3600)
-
-            mean_offset = np.mean([offset_axis1, offset_axis2])
-            print(
-                "Astrometric precision after run %d: %.2f arcseconds. Required: %.2f."
-                % (i, mean_offset, accuracy)
-            )
+def _astrometric_calib_one(ima, config, soft="scamp",
+                           accuracy=0.5, itermax=10, verbose="NORMAL"):
+    """perform astrometric calibration of a single image"""
 
-            pixelscale = doc["VOTABLE"]["RESOURCE"]["RESOURCE"]["TABLE"][0]["DATA"][
-                "TABLEDATA"
-            ]["TR"]["TD"][18].split("  ")
-            pixelscale = [float(pixelscale[0]) / 3600,
-                          float(pixelscale[1]) / 3600]
-            # Update header of input fits file
-            update_headers_scamp(ima, "prepscamp.head", pixelscale)
-        # cp_p('prepscamp.cat', _name.split('.')[0]+'.cat')
-        #  Delete temporary files
-        clean_tmp_files(ima, soft="scamp")
-    print("\n")
+    #  Use scamp for astrometric calibration
+    if soft == "scamp":
+        _scamp_one(ima, config, accuracy=accuracy,
+                   itermax=itermax, verbose=verbose)
+
+    #  Use astrometry.net for astrometric calibration
+    elif soft == "astrometrynet":
+        # Get pixel scale in degrees
+        header = get_header(ima)
+        pixScale = get_pixscale(header)
+        #  Set up boundaries for plate scale for astrometry.net
+        scaleLow = 0.7 * pixScale * 3600
+        scaleHigh = 1.3 * pixScale * 3600
+        radius = max(header["NAXIS1"] * pixScale,
+                     header["NAXIS2"] * pixScale)
+        astrometrynet(ima, radius=radius, scaleLow=scaleLow,
+                      scaleHigh=scaleHigh)
 
 
 def astrometric_calib(filenames, config, soft="scamp",
-                      accuracy=0.5, itermax=10, verbose="NORMAL"):
+                      accuracy=0.5, itermax=10, verbose="NORMAL",
+                      nb_threads=4):
     """perform astrometric calibration"""
 
     imagelist = np.atleast_1d(filenames)
-    for ima in imagelist:
-        #  Use scamp for astrometric calibration
-        if soft == "scamp":
-            scamp(ima, config, accuracy=accuracy,
-                  itermax=itermax, verbose=verbose)
-
-        #  Use astrometry.net for astrometric calibration
-        elif soft == "astrometrynet":
-            # Get pixel scale in degrees
-            header = fits.getheader(ima)
-            try:
-                pixScale = abs(header["CDELT1"])
-            except Exception:
-                try:
-                    pixScale = abs(header["CD1_1"])
-                except Exception:
-                    print(
-                        "Pixel scale could not be found in fits header.\n Expected keyword: CDELT1, _DELT1 or CD1_1"
-                    )
-            #  Set up boundaries for plate scale for astrometry.net
-            scaleLow = 0.7 * pixScale * 3600
-            scaleHigh = 1.3 * pixScale * 3600
-            radius = max(header["NAXIS1"] * pixScale,
-                         header["NAXIS2"] * pixScale)
-            asrometrynet(ima, radius=radius, scaleLow=scaleLow,
-                         scaleHigh=scaleHigh)
+    # The work is done by external softs, each image/quadrant using its
+    # own temporary files, so threads are enough to run them concurrently.
+    nb_threads = max(1, min(nb_threads, len(imagelist)))
+    with ThreadPoolExecutor(max_workers=nb_threads) as executor:
+        futures = [
+            executor.submit(
+                _astrometric_calib_one,
+                ima,
+                config,
+                soft=soft,
+                accuracy=accuracy,
+                itermax=itermax,
+                verbose=verbose
+            )
+            for ima in imagelist
+        ]
+        # Propagate any exception raised in the threads
+        for future in futures:
+            future.result()
+    print("\n")
@@ -14,6 +14,8 @@ import shutil
 import os
 import argparse
 import warnings
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 from gmadet.phot_calibration import phot_calib
 from gmadet.utils import (
@@ -56,6 +58,229 @@ from copy import deepcopy
 warnings.simplefilter(action="ignore", category=FutureWarning)
 
 
+# Telescope config, set once per worker process by _init_worker()
+CONFIG = None
+
+
+def _init_worker(config):
+    """Store the telescope config in the worker process"""
+    global CONFIG
+    CONFIG = config
+
+
+def process_one(raw_filename, subdir, args):
+    """Run the whole detection pipeline on a single image"""
+
+    config = CONFIG
+    Nb_cuts = (args.quadrants, args.quadrants)
+
+    filename = make_results_dir(
+        raw_filename,
+        outputDir=os.path.join(args.path_results, subdir),
+        keep=args.keep,
+        skip=args.skip,
+        copy=False if args.preprocess else True
+    )
+
+    if not filename:
+        print("%s is already processed, skipping. \n" % raw_filename)
+        return
+
+    if args.preprocess:
+        # We need to call external code what will copy (processed)
+        # image to results dir
+        print("Pre-processing %s" % raw_filename)
+        subprocess.call(args.preprocess.split() + [raw_filename,
+                                                   filename])
+
+        if not os.path.exists(filename):
+            print("Pre-processing failed")
+            return
+
+    # If there is simulated_objects.list file alongside the image,
+    # let's copy it to the results dir
+    if os.path.exists(
+            os.path.join(
+                os.path.dirname(raw_filename),
+                'simulated_objects.list'
+            )):
+        cp_p(os.path.join(os.path.dirname(raw_filename),
+                          'simulated_objects.list'),
+             os.path.join(os.path.dirname(filename),
+                          'simulated_objects.list')
+             )
+        # Rename the "filename" location in the copied
+        # 'simulated_objects.list'
+        fname = os.path.join(
+            os.path.dirname(filename),
+            'simulated_objects.list')
+        sim_obj = ascii.read(fname)
+
+        newname_list = []
+        for i in range(len(sim_obj)):
+            newname = os.path.join(
+                os.path.dirname(filename),
+                os.path.split(sim_obj[i]['filename'])[1]
+            )
+            newname_list.append(os.path.abspath(newname))
+        sim_obj['filename'] = newname_list
+        sim_obj.write(fname, format='ascii.commented_header',
+                      overwrite=True)
+
+    print("Sanitise header and data of %s.\n" % filename)
+    sanitise_fits(filename)
+
+    # Cut image into several quadrants if required
+    # And create table with filename and quadrant ID
+    image_table = cut_image(
+        filename,
+        config,
+        Nb_cuts=Nb_cuts,
+        doAstrometry=args.doAstrometry
+    )
+
+    if args.Remove_cosmics:
+        print(
+            "Running lacosmic on %s to remove cosmic rays. \n" %
+            filename)
+        # Clean cosmic rays
+        # Not using FWHM anymore
+        FWHM_list = [None] * len(image_table)
+        run_lacosmic(
+            image_table["filenames"],
+            FWHM_list,
+            contrast=5.0,
+            cr_threshold=5.0,
+            neighbor_threshold=5.0,
+            maxiter=4,
+            outLevel=args.outLevel
+        )
+
+    if args.sub_bkg:
+        # Substract background
+        bkg_estimation(
+            image_table["filenames"],
+            box=(20, 20),
+            filter_size=(3, 3),
+            bkg_estimator='SExtractor',
+            sigma=3.,
+            sigma_lower=None,
+            sigma_upper=None,
+            maxiters=10,
+            outLevel=args.outLevel,
+        )
+
+    if args.FWHM == "psfex":
+        # Estimate the PSF FWHM for each image/quadrants using psfex
+        FWHM_list = psfex(
+            image_table["filenames"],
+            config,
+            verbose=args.verbose,
+            outLevel=args.outLevel,
+        )
+    else:
+        FWHM_list = [args.FWHM] * len(image_table)
+
+    if args.doAstrometry != "no":
+        astrometric_calib(
+            image_table["filenames"],
+            config,
+            soft=args.doAstrometry,
+            verbose=args.verbose,
+            accuracy=0.15,
+            itermax=10
+        )
+
+    if args.doSub:
+        substracted_files = substraction(
+            image_table["filenames"],
+            args.doSub,
+            config,
+            soft="hotpants",
+            method=args.ps1_method,
+            doMosaic=args.doMosaic,
+            verbose=args.verbose,
+            outLevel=args.outLevel,
+            nb_threads=8
+        )
+    else:
+        substracted_files = None
+
+    if args.soft == "sextractor":
+        run_sextractor(
+            image_table["filenames"],
+            FWHM_list,
+            args.threshold,
+            args.telescope,
+            config,
+            verbose=args.verbose,
+            subFiles=substracted_files,
+            outLevel=args.outLevel,
+            nb_threads=8
+        )
+
+    filter_sources(
+        image_table["filenames"],
+        args.soft,
+        sigma=1,
+        subFiles=substracted_files,
+    )
+
+    convert_xy_radec(
+        image_table["filenames"],
+        soft=args.soft,
+        subFiles=substracted_files
+    )
+
+    total_sources = catalogs(
+        image_table,
+        args.radius_crossmatch,
+        Nb_cuts=Nb_cuts,
+        subFiles=substracted_files,
+        nb_threads=4,
+        method=args.crossmatch_method
+    )
+
+    # The raidus is used here to crossmatch our sources with
+    # catalogs to derive the Zeropoint. Better keep 3 pixels.
+    sources_calib, candidates = phot_calib(
+        total_sources,
+        args.telescope,
+        radius=3,
+        doPlot=True,
+        subFiles=substracted_files,
+        nb_threads=4
+    )
+
+    candidates = moving_objects(candidates)
+
+    # Apply filter to candidates
+    # Remove candidates on the edge
+    # Remove candidate depending the FWHM ratio
+    # Apply the CNN model
+    candidates_filtered = filter_candidates(
+        candidates
+    )
+
+    # If both arguments VOE_path and owncloud_path are provided
+    # Send candidates to database
+    # Set the tile_id corresponding to your tile by hand at the moment
+    if args.VOE_path and args.owncloud_path:
+        send_data2DB(
+            filename,
+            candidates_filtered,
+            Nb_cuts,
+            args.owncloud_path,
+            args.VOE_path,
+            "utilsDB/usrpwd.json",
+            debug=True,
+            subFiles=substracted_files,
+        )
+
+    # clean output files
+    clean_outputs(image_table["filenames"], args.outLevel)
+
+
 def main():
 
     path_gmadet = getpath()
@@ -125,6 +350,19 @@ def main():
              "(Default: 3.0 pixels)",
     )
 
+    parser.add_argument(
+        "--crossmatch-method",
+        dest="crossmatch_method",
+        required=False,
+        default="xmatch",
+        choices=["xmatch", "local"],
+        type=str,
+        help="How to crossmatch sources with catalogs. 'xmatch' uses the "
+             "CDS XMatch service, 'local' downloads the catalog sources "
+             "around the image once with Vizier and crossmatch them "
+             "locally. (Default: xmatch)",
+    )
+
     parser.add_argument(
         "--threshold",
         dest="threshold",
@@ -188,6 +426,18 @@ def main():
              "(Default: scamp)",
     )
 
+    parser.add_argument(
+        "--nproc",
+        dest="nproc",
+        required=False,
+        type=int,
+        default=1,
+        help="Number of images processed in parallel. "
+             "Can not be used with --sub, as the PS1 reference cells "
+             "are downloaded and resampled in a directory shared by all "
+             "images. (Default: 1)",
+    )
+
     parser.add_argument(
         "--verbose",
         dest="verbose",
@@ -277,218 +527,34 @@ def main():
     # args, filenames = parser.parse_known_args()
     args, filenames = parser.parse_known_args()
 
-    Nb_cuts = (args.quadrants, args.quadrants)
+    if args.nproc > 1 and args.doSub:
+        parser.error("--nproc > 1 can not be used with --sub.")
 
     # Load config files for a given telescope
     config = load_config(args.telescope, args.convFilter)
 
     filenames, subdirs = list_files(filenames, exclude=args.path_results)
 
-    for raw_filename, subdir in zip(filenames, subdirs):
-        filename = make_results_dir(
-            raw_filename,
-            outputDir=os.path.join(args.path_results, subdir),
-            keep=args.keep,
-            skip=args.skip,
-            copy=False if args.preprocess else True
-        )
-
-        if not filename:
-            print("%s is already processed, skipping. \n" % raw_filename)
-            continue
-
-        if args.preprocess:
-            # We need to call external code what will copy (processed)
-            # image to results dir
-            print("Pre-processing %s" % raw_filename)
-            subprocess.call(args.preprocess.split() + [raw_filename,
-                                                       filename])
-
-            if not os.path.exists(filename):
-                print("Pre-processing failed")
-                continue
-
-        # If there is simulated_objects.list file alongside the image,
-        # let's copy it to the results dir
-        if os.path.exists(
-                os.path.join(
-                    os.path.dirname(raw_filename),
-                    'simulated_objects.list'
-                )):
-            cp_p(os.path.join(os.path.dirname(raw_filename),
-                              'simulated_objects.list'),
-                 os.path.join(os.path.dirname(filename),
-                              'simulated_objects.list')
-                 )
-            # Rename the "filename" location in the copied
-            # 'simulated_objects.list'
-            fname = os.path.join(
-                os.path.dirname(filename),
-                'simulated_objects.list')
-            sim_obj = ascii.read(fname)
-
-            newname_list = []
-            for i in range(len(sim_obj)):
-                newname = os.path.join(
-                    os.path.dirname(filename),
-                    os.path.split(sim_obj[i]['filename'])[1]
-                )
-                newname_list.append(os.path.abspath(newname))
-            sim_obj['filename'] = newname_list
-            sim_obj.write(fname, format='ascii.commented_header',
-                          overwrite=True)
-
-        print("Sanitise header and data of %s.\n" % filename)
-        sanitise_fits(filename)
-
-        # Cut image into several quadrants if required
-        # And create table with filename and quadrant ID
-        image_table = cut_image(
-            filename,
-            config,
-            Nb_cuts=Nb_cuts,
-            doAstrometry=args.doAstrometry
-        )
-
-        if args.Remove_cosmics:
-            print(
-                "Running lacosmic on %s to remove cosmic rays. \n" %
-                filename)
-            # Clean cosmic rays
-            # Not using FWHM anymore
-            FWHM_list = [None] * len(image_table)
-            run_lacosmic(
-                image_table["filenames"],
-                FWHM_list,
-                contrast=5.0,
-                cr_threshold=5.0,
-                neighbor_threshold=5.0,
-                maxiter=4,
-                outLevel=args.outLevel
-            )
-
-        if args.sub_bkg:
-            # Substract background
-            bkg_estimation(
-                image_table["filenames"],
-                box=(20, 20),
-                filter_size=(3, 3),
-                bkg_estimator='SExtractor',
-                sigma=3.,
-                sigma_lower=None,
-                sigma_upper=None,
-                maxiters=10,
-                outLevel=args.outLevel,
-            )
-
-        if args.FWHM == "psfex":
-            # Estimate the PSF FWHM for each image/quadrants using psfex
-            FWHM_list = psfex(
-                image_table["filenames"],
-                config,
-                verbose=args.verbose,
-                outLevel=args.outLevel,
-            )
-        else:
-            FWHM_list = [args.FWHM] * len(image_table)
-
-        if args.doAstrometry != "no":
-            astrometric_calib(
-                image_table["filenames"],
-                config,
-                soft=args.doAstrometry,
-                verbose=args.verbose,
-                accuracy=0.15,
-                itermax=10
-            )
-
-        if args.doSub:
-            substracted_files = substraction(
-                image_table["filenames"],
-                args.doSub,
-                config,
-                soft="hotpants",
-                method=args.ps1_method,
-                doMosaic=args.doMosaic,
-                verbose=args.verbose,
-                outLevel=args.outLevel,
-                nb_threads=8
-            )
-        else:
-            substracted_files = None
-
-        if args.soft == "sextractor":
-            run_sextractor(
-                image_table["filenames"],
-                FWHM_list,
-                args.threshold,
-                args.telescope,
-                config,
-                verbose=args.verbose,
-                subFiles=substracted_files,
-                outLevel=args.outLevel,
-                nb_threads=8
-            )
-
-        filter_sources(
-            image_table["filenames"],
-            args.soft,
-            sigma=1,
-            subFiles=substracted_files,
-        )
-
-        convert_xy_radec(
-            image_table["filenames"],
-            soft=args.soft,
-            subFiles=substracted_files
-        )
-
-        total_sources = catalogs(
-            image_table,
-            args.radius_crossmatch,
-            Nb_cuts=Nb_cuts,
-            subFiles=substracted_files,
-            nb_threads=4
-        )
-
-        # The raidus is used here to crossmatch our sources with
-        # catalogs to derive the Zeropoint. Better keep 3 pixels.
-        sources_calib, candidates = phot_calib(
-            total_sources,
-            args.telescope,
-            radius=3,
-            doPlot=True,
-            subFiles=substracted_files,
-            nb_threads=4
-        )
-
-        candidates = moving_objects(candidates)
-
-        # Apply filter to candidates
-        # Remove candidates on the edge
-        # Remove candidate depending the FWHM ratio
-        # Apply the CNN model
-        candidates_filtered = filter_candidates(
-            candidates
-        )
-
-        # If both arguments VOE_path and owncloud_path are provided
-        # Send candidates to database
-        # Set the tile_id corresponding to your tile by hand at the moment
-        if args.VOE_path and args.owncloud_path:
-            send_data2DB(
-                filename,
-                candidates_filtered,
-                Nb_cuts,
-                args.owncloud_path,
-                args.VOE_path,
-                "utilsDB/usrpwd.json",
-                debug=True,
-                subFiles=substracted_files,
-            )
-
-        # clean output files
-        clean_outputs(image_table["filenames"], args.outLevel)
+    if args.nproc <= 1:
+        # Run in the main process to keep tracebacks and Ctrl-C simple
+        _init_worker(config)
+        for raw_filename, subdir in zip(filenames, subdirs):
+            process_one(raw_filename, subdir, args)
+        return
+
+    # Images are processed independently, so dispatch them to a pool of
+    # worker processes. ProcessPoolExecutor workers are not daemonic,
+    # so they can still spawn the multiprocessing pools used internally
+    # by substraction (hotpants) and filter_candidates.
+    # The config is sent once to each worker instead of with every image.
+    with ProcessPoolExecutor(max_workers=args.nproc,
+                             initializer=_init_worker,
+                             initargs=(config,)) as executor:
+        list(executor.map(
+            partial(process_one, args=args),
+            filenames,
+            subdirs
+        ))
 
 
 if __name__ == "__main__":
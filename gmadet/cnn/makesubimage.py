@@ -149,7 +149,8 @@ def crossmatch_detections(path, candidates_list, radius=1):
         # an another solution to speed up the loop.
         # For now we just ignore it.
         # mask1 = candidates_list["OriginalIma"] == event["filename2"]
-        candidates = deepcopy(candidates_list)  # [mask1])
+        # Sorted in place below, so the data must be copied.
+        candidates = candidates_list.copy()  # [mask1])
 
         # Compute the separation with detections and sort by ascending values
         offset = SkyCoord(
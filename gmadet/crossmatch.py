@@ -10,16 +10,17 @@ import os
 import numpy as np
 from astropy.io import ascii, fits
 from astropy.table import Table, vstack, Column
-from astropy.coordinates import SkyCoord
+from astropy.coordinates import SkyCoord, UnitSphericalRepresentation
 from astropy import units as u
 from astropy import wcs
 from astropy.time import Time
 from astroquery import xmatch
+from astroquery.vizier import Vizier
 from astroquery.imcce import Skybot
 from astroML.crossmatch import crossmatch_angular
-from copy import deepcopy
-import multiprocessing as mp
-from gmadet.utils import get_corner_coords
+from concurrent.futures import ThreadPoolExecutor
+from gmadet.utils import (get_corner_coords, get_header, get_pixscale,
+                          split_filename)
 
 def _run_xmatch(coordinates, catalog, radius):
     """
@@ -75,18 +76,14 @@ def run_xmatch(coordinates, catalog, radius, nb_threads):
             idx_stop.append(Ncat)
         if idx_stop[-1] >= Ncat:
             break
-    pool = mp.Pool(nb_threads)
-    # call apply_async() without callback
-    result_objects = [pool.apply_async(_run_xmatch,
-                                args=(cat, catalog, radius))
-                          for cat in catalog_list]
-
-    # result_objects is a list of pool.ApplyResult objects
-    results = [r.get() for r in result_objects]
-
-    # Don't forget to close
-    pool.close()
-    pool.join()
+    # Queries are limited by the network, so threads are enough.
+    # They share the XMatch HTTP session, so connections to the CDS
+    # are reused from one query to the next.
+    with ThreadPoolExecutor(max_workers=nb_threads) as executor:
+        results = list(executor.map(
+            lambda cat: _run_xmatch(cat, catalog, radius),
+            catalog_list
+        ))
 
     # If one table is empty and one returns something,
     # there will be a conflict type, str vs something.
@@ -105,13 +102,60 @@ def run_xmatch(coordinates, catalog, radius, nb_threads):
     return crossmatch
 
 
+def run_local_xmatch(coordinates, catalog, radius):
+    """
+    Perform cross-match with a catalog locally.
+    Download once all the catalog sources in the sky region covered by
+    the coordinates using Vizier, and crossmatch them with astropy.
+    parameters: coordinates, catalog, radius:
+                coordinates: astropy table with RA, DEC of all detected sources
+                catalog: Vizier identifier of the catalog
+                radius in arcsecond
+    returns: astropy.table object with the coordinates having a match
+    """
+    # Nothing to match, and the center of the region would be NaN
+    if len(coordinates) == 0:
+        return coordinates[:0]
+
+    coords = SkyCoord(coordinates["_RAJ2000"], coordinates["_DEJ2000"],
+                      unit=(u.deg, u.deg), frame="icrs")
+    # Center of the region, robust to RA wrapping around 0.
+    center = SkyCoord(
+        coords.cartesian.mean().represent_as(UnitSphericalRepresentation),
+        frame="icrs"
+    )
+    region_radius = np.max(center.separation(coords)) + radius * u.arcsec
+
+    vizier = Vizier(columns=["_RAJ2000", "_DEJ2000"], row_limit=-1)
+    vizier.TIMEOUT = 3600
+    result = vizier.query_region(center, radius=region_radius,
+                                 catalog=catalog)
+    if len(result) == 0 or len(result[0]) == 0:
+        return coordinates[np.zeros(len(coordinates), dtype=bool)]
+
+    cat_coords = SkyCoord(result[0]["_RAJ2000"], result[0]["_DEJ2000"],
+                          unit=(u.deg, u.deg), frame="icrs")
+    _, d2d, _ = coords.match_to_catalog_sky(cat_coords)
+
+    return coordinates[d2d < radius * u.arcsec]
+
+
 def catalogs(image_table, radius,
              catalogs=["I/345/gaia2", "II/349/ps1", "I/271/out", "I/284/out"],
-             Nb_cuts=(1, 1), subFiles=None, nb_threads=4):
+             Nb_cuts=(1, 1), subFiles=None, nb_threads=4,
+             min_candidates=10, method="xmatch"):
     """
     Input file is *.magwcs and the output is the list of the stars *.oc
     which were not identified in the catalogue
     radius is expressed in pixels
+    Catalogs are queried in the given order, each one with the sources
+    not matched by the previous ones. So better put the densest catalog
+    first to reduce the following queries as much as possible.
+    Stop querying catalogs once less than min_candidates sources are left
+    unmatched, these are likely to be real transients.
+    method is either "xmatch" to use the CDS XMatch service, or "local"
+    to download the catalog sources around the image with Vizier and
+    crossmatch them locally.
     """
 
     cat_dict = {
@@ -132,17 +176,15 @@ def catalogs(image_table, radius,
     else:
         filelist = image_table["filenames"]
 
-    # Initialise one variable
-    detected_sources_tot = None
+    # Get pixel scale in degrees.
+    # All quadrants and substracted images share the same pixel scale.
+    pixScale = get_pixscale(get_header(filelist[0]))
+
+    # Tables of detected sources in each file, stacked once at the end
+    detected_sources_list = []
 
     for i, filename in enumerate(filelist):
-        path, filename_ext = os.path.split(filename)
-        if path:
-            folder = path + "/"
-        else:
-            folder = ""
-        #  Get rid of the extension to keep only the name
-        filename2,extension = os.path.splitext(filename_ext)
+        folder, filename2, extension = split_filename(filename)
 
         magfilewcs = folder + filename2 + ".magwcs"
 
@@ -164,19 +206,8 @@ def catalogs(image_table, radius,
             """
         _filename_list.append(original_name + ".oc")
 
-        header = fits.getheader(filename)
-        # Get pixel scale in degrees
-        try:
-            pixScale = abs(header["CDELT1"])
-        except BaseException:
-            try:
-                pixScale = abs(header["CD1_1"])
-            except BaseException:
-                print(
-                    "Pixel scale could not be found in fits header.\n Expected keyword: CDELT1, _DELT1 or CD1_1"
-                )
-
-        # Load detected sources in astropy table
+        # Load detected sources in astropy table.
+        # Format is known, so skip format guessing.
         detected_sources = ascii.read(
             magfilewcs,
             names=[
@@ -198,6 +229,7 @@ def catalogs(image_table, radius,
                 "RefIma",
             ],
             format="commented_header",
+            guess=False,
         )
 
         if detected_sources:
@@ -224,11 +256,10 @@ def catalogs(image_table, radius,
             detected_sources["Xpos_quad"] = detected_sources["Xpos"]
             detected_sources["Ypos_quad"] = detected_sources["Ypos"]
 
-            if detected_sources_tot is None:
-                detected_sources_tot = deepcopy(detected_sources)
-            else:
-                detected_sources_tot = vstack(
-                    [detected_sources_tot, detected_sources])
+            detected_sources_list.append(detected_sources)
+
+    detected_sources_tot = vstack(detected_sources_list,
+                                  metadata_conflicts='silent')
     # Add units
     detected_sources_tot["_RAJ2000"] *= u.deg
     detected_sources_tot["_DEJ2000"] *= u.deg
@@ -246,9 +277,9 @@ def catalogs(image_table, radius,
     else:
         mask_sub = np.ones(len(detected_sources_tot), dtype=bool)
 
-    candidates = deepcopy(
-            detected_sources_tot["_RAJ2000", "_DEJ2000",
-                "idx", "Match", "FlagSub"][mask_sub])
+    # Masking already returns a new table, no need to copy it.
+    candidates = detected_sources_tot["_RAJ2000", "_DEJ2000",
+                                      "idx", "FlagSub"][mask_sub]
 
     # candidates.write('test0.dat', format='ascii.commented_header', overwrite=True)
     print("\nCrossmatching sources with catalogs.")
@@ -257,48 +288,56 @@ def catalogs(image_table, radius,
         % (radius * pixScale * 3600)
     )
 
-    mask_matched = candidates["Match"] == "N"
+    # True for candidates without any match in catalogs so far
+    mask_matched = np.ones(len(candidates), dtype=bool)
+    if subFiles is not None:
+        mask2 = candidates["FlagSub"] == "Y"
     for catalog in catalogs:
-        print(catalog, len(candidates[mask_matched]), ' sources to crossmatch.')
-        # Use Xmatch to crossmatch with catalog
-        crossmatch = run_xmatch(
-            candidates[mask_matched], catalog,
-            radius * pixScale * 3600, nb_threads
-        )
+        nb_before = np.sum(mask_matched)
+        print(catalog, nb_before, ' sources to crossmatch.')
+        if method == "local":
+            crossmatch = run_local_xmatch(
+                candidates[mask_matched], catalog,
+                radius * pixScale * 3600
+            )
+        else:
+            # Use Xmatch to crossmatch with catalog
+            crossmatch = run_xmatch(
+                candidates[mask_matched], catalog,
+                radius * pixScale * 3600, nb_threads
+            )
 
         # crossmatch.write('test.dat', format='ascii.commented_header', overwrite=True)
         # Do not consider duplicates
-        #  Meaning that if there are several sources
-        #  we consider it as a crossmatch
-        _, referenced_star_idx = np.unique(crossmatch["idx"], return_index=True)
-        # First keep only the first occurence to a given idx.
-        crossmatch = crossmatch[referenced_star_idx]
-        idx_match = np.isin(candidates['idx'],
-                            crossmatch['idx'])
-        # Then apply it the candidates table to flag referenced sources.
-        candidates["Match"][idx_match] = "Y"
-
-        #  Update Match mask
-        mask_matched = candidates["Match"] == "N"
+        #  Meaning that if there are several sources
+        #  we consider it as a crossmatch.
+        #  np.isin does not care about duplicated idx.
+        #  Update Match mask
+        mask_matched &= ~np.isin(candidates['idx'], crossmatch['idx'])
 
         if subFiles is not None:
-            mask = (candidates["FlagSub"] == "Y") & (mask_matched)
-            mask2 = candidates["FlagSub"] == "Y"
+            mask = mask2 & mask_matched
             print(
                 "%d/%d candidates left in substracted images after crossmatching with %s"
-                % (len(candidates[mask]), len(candidates[mask2]), cat_dict[catalog])
+                % (np.sum(mask), np.sum(mask2), cat_dict[catalog])
             )
         else:
             print(
                 "%d/%d candidates left after crossmatching with %s"
-                % (len(candidates[mask_matched]), len(candidates), cat_dict[catalog])
+                % (np.sum(mask_matched), len(candidates), cat_dict[catalog])
             )
-        if len(candidates[mask_matched]) == 0:
+        print(
+            "%.1f%% of the remaining sources crossmatched with %s"
+            % (100 * (1 - np.sum(mask_matched) / max(nb_before, 1)),
+               cat_dict[catalog])
+        )
+        if np.sum(mask_matched) < max(min_candidates, 1):
             break
 
-    # Flag sources without any match in catalogs
-    idx_no_match = np.isin(detected_sources_tot['idx'],
-                           candidates['idx'][mask_matched])
+    # Flag sources without any match in catalogs.
+    # 'idx' is the row number in detected_sources_tot.
+    idx_no_match = np.zeros(len(detected_sources_tot), dtype=bool)
+    idx_no_match[candidates['idx'][mask_matched]] = True
     #candidates = deepcopy(detected_sources_tot[keep_idx])
     # Add the Match flag in original table data
     detected_sources_tot['Match'][~idx_no_match] = "Y"
@@ -449,8 +488,8 @@ def moving_objects(candidates, radius_cross=10):
     crossmatch is made at a single time defined by DATE-OBS, so this allows
     for flexibility.
     """
-    # Initialise with None
-    moving_objects_tot = None
+    # Moving objects found around each image, stacked once at the end
+    moving_objects_list = []
 
     # Add new columns to candidates with initialisation
     moving_obj_match = Column(['N'] * len(candidates),
@@ -520,11 +559,7 @@ def moving_objects(candidates, radius_cross=10):
         moving_objects = skybot(ra_deg, dec_deg, date, radius, Texp)
 
         if moving_objects is not None:
-            if moving_objects_tot is None:
-                moving_objects_tot = deepcopy(moving_objects)
-            else:
-                moving_objects_tot = vstack([moving_objects_tot,
-                                             moving_objects])
+            moving_objects_list.append(moving_objects)
 
             candidates_matched = crossmatch_skybot(
                 candidates[mask], moving_objects, radius=radius_cross)
@@ -538,17 +573,13 @@ def moving_objects(candidates, radius_cross=10):
     )
 
     # Set up output path and file names
-    path, fname_ext = os.path.split(candidates['OriginalIma'][0])
-    if path:
-        folder = path + "/"
-    else:
-        folder = ""
-    # Get rid of the extension to keep only the name
-    fname2, extension = os.path.splitext(fname_ext)
+    folder, fname2, extension = split_filename(candidates['OriginalIma'][0])
     # Get rid of the _reg suffix
     fname2 = fname2.split('_reg')[0]
 
-    if moving_objects_tot is not None:
+    if moving_objects_list:
+        moving_objects_tot = vstack(moving_objects_list,
+                                    metadata_conflicts='silent')
         moving_objects_tot.write(
             folder + fname2 + "_moving_objects.dat",
             format="ascii.commented_header", overwrite=True
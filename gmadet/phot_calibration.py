@@ -5,13 +5,13 @@
 # David Corre, corre@lal.in2p3.fr
 #
 
-import os
 import numpy as np
 import matplotlib.pyplot as plt
 import warnings
 
 from gmadet.crossmatch import run_xmatch
-from gmadet.utils import get_phot_cat, filter_catalog_data
+from gmadet.utils import (get_phot_cat, filter_catalog_data, get_pixscale,
+                          split_filename)
 from gmadet.phot_conversion import *
 
 from astropy.io import ascii, fits
@@ -19,8 +19,6 @@ from astropy import units as u
 from astropy.table import vstack, Table, Column, join
 from astropy.stats import sigma_clip
 
-from copy import deepcopy
-
 warnings.simplefilter(action="ignore")
 
 
@@ -43,8 +41,9 @@ def crossmatch(detected_sources, radius, pixScale, catalog, nb_threads=4):
         (detected_sources["FlagSub"] == "N")
 
     # Run xmatch to crossmatch detected sources with available catalog
-    # reduce size of the input catalog to its minimum
-    cat = deepcopy(detected_sources["_RAJ2000", "_DEJ2000", "idx"])
+    # reduce size of the input catalog to its minimum.
+    # Selecting columns already returns a new table.
+    cat = detected_sources["_RAJ2000", "_DEJ2000", "idx"]
     crossmatch = run_xmatch(
         cat[mask],
         catalog,
@@ -230,16 +229,7 @@ def phot_calib(detected_sources, telescope, radius=3, sigma_clip=1.5,
     # Get pixel scale in degrees
 
     header = fits.getheader(detected_sources['OriginalIma'][0])
-    try:
-        pixScale = abs(header["CDELT1"])
-    except Exception:
-        try:
-            pixScale = abs(header["CD1_1"])
-        except Exception:
-            print(
-                "Pixel scale could not be found in fits header.\n"
-                "Expected keyword: CDELT1 or CD1_1"
-            )
+    pixScale = get_pixscale(header)
     # Get filter and catalog to perform photometric calibration
     band_DB, band_cat, catalog = get_phot_cat(
             detected_sources['OriginalIma'][0],
@@ -299,13 +289,7 @@ def phot_calib(detected_sources, telescope, radius=3, sigma_clip=1.5,
         # So it is much better to use this method
 
         # Get path and filename to images
-        path, fname_ext = os.path.split(good_ref_sources['OriginalIma'][0])
-        if path:
-            folder = path + "/"
-        else:
-            folder = ""
-        # Get rid of the extension to keep only the name
-        fname2, extension = os.path.splitext(fname_ext)
+        folder, fname2, extension = split_filename(good_ref_sources['OriginalIma'][0])
         # Get rid of the _reg suffix
         fname2 = fname2.split('_reg')[0]
         # Transform filter bands in catalog to telescope ones
@@ -332,14 +316,7 @@ def phot_calib(detected_sources, telescope, radius=3, sigma_clip=1.5,
             print("Processing photometric calibration for ", key[0])
             mask_key = good_ref_sources['OriginalIma'] == key[0]
             # Get path and filename to images
-            path, fname_ext = os.path.split(key[0])
-            if path:
-                folder = path + "/"
-            else:
-                folder = ""
-
-            # Get rid of the extension to keep only the name
-            fname2, extension = os.path.splitext(fname_ext)
+            folder, fname2, extension = split_filename(key[0])
 
             # Get filter and catalog to perform photometric calibration
             band_DB, band_cat, catalog = get_phot_cat(key[0], telescope)
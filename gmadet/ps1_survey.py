@@ -16,7 +16,8 @@ from astropy import units as u
 from astropy.table import Table, vstack
 from shapely.geometry import Polygon
 
-from gmadet.utils import (rm_p, mkdir_p, load_config, getpath)
+from gmadet.utils import (rm_p, mkdir_p, load_config, getpath,
+                          get_pixscale)
 from gmadet.astrometry import scamp
 
 
@@ -572,28 +573,20 @@ def create_ps1_mosaic(file_list, inputimage, outputDir, config,
     #  Create list of mask fits
     ima_list = [ima for ima in file_list if "_mask" not in ima]
     mask_list = [ima for ima in file_list if "_mask" in ima]
-    np.savetxt("mosaic.list", ima_list, fmt="%s")
-    np.savetxt("mask.list", mask_list, fmt="%s")
 
     imagefiles = [
         outputDir + os.path.splitext(filenameInput)[0] + "_ps1_mosaic",
         outputDir + os.path.splitext(filenameInput)[0] + "_ps1_mosaic_mask",
     ]
+    # swarp temporary files are named after the input image so that
+    # several images can be processed at once.
+    np.savetxt(imagefiles[0] + ".list", ima_list, fmt="%s")
+    np.savetxt(imagefiles[1] + ".list", mask_list, fmt="%s")
 
     # Get pixel scale from input image header
     header = fits.getheader(inputimage)
 
-    try:
-        pixScale = abs(header["CDELT1"])
-    except Exception:
-        try:
-            pixScale = abs(header["CD1_1"])
-        except Exception:
-            print(
-                "Pixel scale could not be found in fits header.\n"
-                "Expected keyword: CDELT1 or CD1_1"
-            )
-    pixScale = pixScale * 3600
+    pixScale = get_pixscale(header) * 3600
     # print (inputimage, pixScale)
     crval1 = header["CRVAL1"]
     crval2 = header["CRVAL2"]
@@ -605,7 +598,7 @@ def create_ps1_mosaic(file_list, inputimage, outputDir, config,
 
     # File name to store the common header that will be shared by all
     # images in filelist
-    point = "registration"
+    point = imagefiles[0] + "_registration"
     # Delete if already exists
     rm_p(point + ".head")
     # First run swarp to create a .head file containing the shared header
@@ -614,6 +607,8 @@ def create_ps1_mosaic(file_list, inputimage, outputDir, config,
             "swarp",
             "-HEADER_ONLY", "Y",
             "-IMAGEOUT_NAME", point + ".head",
+            "-WEIGHTOUT_NAME", point + ".weight.fits",
+            "-XML_NAME", point + ".xml",
             "-VERBOSE_TYPE", verbose,
         ]
         + [inputimage]
@@ -628,7 +623,8 @@ def create_ps1_mosaic(file_list, inputimage, outputDir, config,
         ]
     )
 
-    imalists = [["@" + "mosaic.list"], ["@" + "mask.list"]]
+    imalists = [["@" + imagefiles[0] + ".list"],
+                ["@" + imagefiles[1] + ".list"]]
     for i, imagefile in enumerate(imagefiles):
         #  Remove mosaic if already exists
         rm_p(imagefile + ".fits")
@@ -647,6 +643,7 @@ def create_ps1_mosaic(file_list, inputimage, outputDir, config,
                     "swarp",
                     "-IMAGEOUT_NAME", imagefile + ".fits",
                     "-WEIGHTOUT_NAME", imagefile + ".weight.fits",
+                    "-XML_NAME", point + ".xml",
                     "-VERBOSE_TYPE", verbose,
                 ]
                 + imalists[i]
@@ -671,6 +668,8 @@ def create_ps1_mosaic(file_list, inputimage, outputDir, config,
                     "-OVERSAMPLING", "0",
                     "-COMBINE_TYPE", "MEDIAN",
                     "-COPY_KEYWORDS", " PIXEL_SCALE",
+                    "-WEIGHTOUT_NAME", point + ".weight.fits",
+                    "-XML_NAME", point + ".xml",
                     "-VERBOSE_TYPE", verbose,
                 ]
                 + imalists[i]
@@ -711,9 +710,10 @@ def create_ps1_mosaic(file_list, inputimage, outputDir, config,
     #    rm_p(ima)
     # for ima in mask_list:
     #    rm_p(ima)
-    rm_p("mosaic.list")
-    rm_p("mask.list")
-    rm_p("swarp.xml")
+    rm_p(imagefiles[0] + ".list")
+    rm_p(imagefiles[1] + ".list")
+    rm_p(point + ".xml")
+    rm_p(point + ".weight.fits")
     rm_p(point + ".head")
     # rm_p('coadd.weight.fits')
 
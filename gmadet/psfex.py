@@ -9,76 +9,69 @@ import os
 import shutil
 import subprocess
 import sys
+import tempfile
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from astropy.io import fits
-from gmadet.utils import (rm_p, mv_p, mkdir_p, getpath)
-import xmltodict
+from gmadet.utils import (mv_p, mkdir_p, getpath, get_xml_fields)
 
 
-def psfex(filename, config, useweight=False,
-          verbose="NORMAL", outLevel=0, outDir=''):
-    """Compute PSF in astronomical images"""
-
-    FWHM_list = []
+def _psfex_one(ima, config, nb_snaps, useweight=False, verbose="NORMAL"):
+    """Compute PSF of a single astronomical image.
+    Returns the mean FWHM in pixels."""
 
-    # imagelist=glob.glob(path+'/*.fits')
-    imagelist = np.atleast_1d(filename)
-    for ima in imagelist:
-        print("\nRunning psfex to estimate FWHM in %s" % ima)
-        root = os.path.splitext(ima)[0]
+    print("\nRunning psfex to estimate FWHM in %s" % ima)
+    root = os.path.splitext(ima)[0]
+    # sextractor and psfex write their outputs with fixed names in the
+    # current directory. Run them in a temporary directory specific to
+    # this image so that several images can be processed at once.
+    with tempfile.TemporaryDirectory(prefix="gmadet_psfex_") as tmpdir:
         if useweight:
-            weight = root + ".weight.fits"
+            weight = os.path.abspath(root + ".weight.fits")
             subprocess.call(
                 [
                     "sex",
-                    ima,
+                    os.path.abspath(ima),
                     "-c", config["psfex"]["sextractor"],
                     "-WEIGHT_IMAGE", weight,
                     "-VERBOSE_TYPE", verbose,
                     "-PARAMETERS_NAME", config["psfex"]["param"],
                     "-FILTER_NAME", config['sextractor']['convFilter'],
-                ]
+                ],
+                cwd=tmpdir
             )
         else:
             subprocess.call(
                 [
                     "sex",
-                    ima,
+                    os.path.abspath(ima),
                     "-c", config["psfex"]["sextractor"],
-                    "-VERBOSE_TYPE", verbose, 
+                    "-VERBOSE_TYPE", verbose,
                     "-PARAMETERS_NAME", config["psfex"]["param"],
                     "-FILTER_NAME", config['sextractor']['convFilter'],
-                ]
+                ],
+                cwd=tmpdir
             )
         cat = "preppsfex.cat"
         subprocess.call(
             ["psfex", cat, "-c", config["psfex"]["conf"],
-             "-VERBOSE_TYPE", verbose]
+             "-VERBOSE_TYPE", verbose],
+            cwd=tmpdir
         )
-        rm_p(cat)
 
-        #  Delete files depending on the required level of output files
-        mv_p("snap_preppsfex.fits", root + "_psf.fits")
+        #  Delete files depending on the required level of output files
+        mv_p(os.path.join(tmpdir, "snap_preppsfex.fits"), root + "_psf.fits")
 
         # Get the mean PSF FWHM in pixels
-        with open("psfex.xml") as fd:
-            doc = xmltodict.parse(fd.read())
-            FWHM_stats = doc["VOTABLE"]["RESOURCE"]["RESOURCE"]["TABLE"][0]["DATA"][
-                "TABLEDATA"
-            ]["TR"]["TD"][20:23]
-            FHWM_min = float(FWHM_stats[0])
-            FHWM_mean = float(FWHM_stats[1])
-            FHWM_max = float(FWHM_stats[2])
-
-            print("\nFWHM min: %.2f pixels" % FHWM_min)
-            print("FWHM mean: %.2f pixels" % FHWM_mean)
-            print("FWHM max: %.2f pixels\n" % FHWM_max)
-
-        #  Get number of psf snapshot per axis
-        psf_snaps = os.popen(
-            "sed -n '/PSFVAR_NSNAP/p' %s" % config["psfex"]["conf"]
-        ).read()
-        nb_snaps = psf_snaps.split()[1]
+        FWHM_stats = get_xml_fields(os.path.join(tmpdir, "psfex.xml"))[20:23]
+        FHWM_min = float(FWHM_stats[0])
+        FHWM_mean = float(FWHM_stats[1])
+        FHWM_max = float(FWHM_stats[2])
+
+        print("\nFWHM min: %.2f pixels" % FHWM_min)
+        print("FWHM mean: %.2f pixels" % FHWM_mean)
+        print("FWHM max: %.2f pixels\n" % FHWM_max)
+
         # Add info to the header
         hdulist = fits.open(root + "_psf.fits")
         hdr = hdulist[0].header
@@ -88,9 +81,35 @@ def psfex(filename, config, useweight=False,
         hdr["PSF_NB"] = str(nb_snaps)
         hdulist.writeto(root + "_psf.fits", overwrite=True)
 
-        FWHM_list.append(FHWM_mean)
+        mv_p(os.path.join(tmpdir, "preppsfex.psf"), root + ".psf")
+        # Keep the check plots, if enabled with CHECKPLOT_TYPE in the
+        # psfex config, next to the image.
+        for plot in glob.glob(os.path.join(tmpdir, "*.png")):
+            mv_p(plot, root + "_" + os.path.basename(plot))
+
+    return FHWM_mean
+
+
+def psfex(filename, config, useweight=False,
+          verbose="NORMAL", outLevel=0, outDir='', nb_threads=4):
+    """Compute PSF in astronomical images"""
+
+    # imagelist=glob.glob(path+'/*.fits')
+    imagelist = np.atleast_1d(filename)
+
+    #  Get number of psf snapshot per axis
+    with open(config["psfex"]["conf"]) as f:
+        psf_snaps = next(line for line in f if "PSFVAR_NSNAP" in line)
+    nb_snaps = psf_snaps.split()[1]
+
+    # sextractor and psfex are external processes, so threads are
+    # enough to run them concurrently.
+    nb_threads = max(1, min(nb_threads, len(imagelist)))
+    with ThreadPoolExecutor(max_workers=nb_threads) as executor:
+        FWHM_list = list(executor.map(
+            lambda ima: _psfex_one(ima, config, nb_snaps,
+                                   useweight=useweight, verbose=verbose),
+            imagelist
+        ))
 
-        mv_p("preppsfex.psf", root + ".psf")
-        rm_p("preppsfex.psf")
-        rm_p("psfex.xml")
     return FWHM_list
@@ -40,17 +40,22 @@ def registration(filelist, config, resultDir="", reference=None,
         files = [inim, refim]
         if refim_mask is not None:
             files = files + [refim_mask]
+        # Root name of the swarp temporary files. It is specific to this
+        # image so that several images can be registered at once.
+        path, filename_ext = os.path.split(inim)
+        point = resultDir + os.path.splitext(filename_ext)[0] + \
+            "_registration_%s" % i
+
         # Save them in a file to give it as an argument to swarp
-        np.savetxt("register.list", files, fmt="%s")
+        np.savetxt(point + ".list", files, fmt="%s")
 
         # Get pixel scale from input image header
         header = fits.getheader(inim)
         pixScale = abs(float(header["CDELT1"])) * 3600
 
-        imalists = ["@" + "register.list"]
+        imalists = ["@" + point + ".list"]
         # File name to store the common header that will be shared by all
-        # images in filelist
-        point = "registration"
+        # images in filelist: point + ".head"
         # Delete if already exists
         rm_p(point + ".head")
         # First run swarp to create a .head file containing the shared header
@@ -59,6 +64,8 @@ def registration(filelist, config, resultDir="", reference=None,
                 "swarp",
                 "-HEADER_ONLY", "Y",
                 "-IMAGEOUT_NAME", point + ".head",
+                "-WEIGHTOUT_NAME", point + ".weight.fits",
+                "-XML_NAME", point + ".xml",
                 "-GAIN_DEFAULT", str(gain),
                 # '-VERBOSE_TYPE', verbose] + imalists)
                 "-VERBOSE_TYPE", verbose,
@@ -118,7 +125,8 @@ def registration(filelist, config, resultDir="", reference=None,
                     "-IMAGEOUT_NAME", epoch + ".fits",
                     "-WEIGHT_TYPE", weight_type,
                     "-WEIGHT_IMAGE", weight_name,
-                    "-WEIGHTOUT_NAME", '.weight.fits',
+                    "-WEIGHTOUT_NAME", point + ".weight.fits",
+                    "-XML_NAME", point + ".xml",
                     # Arbitrary threshold.
                     # Pixels at the edsge after resampling are 0 so
                     # it is enough here
@@ -157,9 +165,9 @@ def registration(filelist, config, resultDir="", reference=None,
 
             rm_p(epoch + ".head")
         rm_p(point + ".head")
-        rm_p("register.list")
-        rm_p("coadd.weight.fits")
-        rm_p('swarp.xml')
+        rm_p(point + ".list")
+        rm_p(point + ".weight.fits")
+        rm_p(point + ".xml")
 
         inim_regist = outFiles[0]
         refim_regist = outFiles[1]
@@ -3,12 +3,11 @@
 
 import subprocess
 import sys
-import os
 import numpy as np
 from astropy.io import fits
 from lacosmic import lacosmic
 from astroscrappy import detect_cosmics
-from gmadet.utils import cp_p
+from gmadet.utils import cp_p, split_filename
 
 
 # Can try to automatise the contrast value with the estimated PSF FWHM
@@ -21,13 +20,7 @@ def run_lacosmic(filename, FWHM, contrast=5, cr_threshold=5,
     imagelist = np.atleast_1d(filename)
 
     for i, ima in enumerate(imagelist):
-        path, filename_ext = os.path.split(ima)
-        if path:
-            folder = path + "/"
-        else:
-            folder = ""
-
-        filename2 = os.path.splitext(filename_ext)[0]
+        folder, filename2, _ = split_filename(ima)
 
         # Make copy of original image
         if outLevel == 2:
@@ -91,13 +84,7 @@ def run_astroscrappy(
     psffwhm = np.atleast_1d(psffwhm)
 
     for i, ima in enumerate(imagelist):
-        path, filename_ext = os.path.split(ima)
-        if path:
-            folder = path + "/"
-        else:
-            folder = ""
-
-        filename2 = os.path.splitext(filename_ext)[0]
+        folder, filename2, _ = split_filename(ima)
 
         # Make copy of original image
         if outLevel == 2:
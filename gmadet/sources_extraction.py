@@ -12,11 +12,11 @@ import os
 import subprocess
 import numpy as np
 
-from astropy.io import ascii, fits
+from astropy.io import fits
 from astropy import wcs
 from astropy.table import Table
-from multiprocessing import Pool
-from gmadet.utils import mv_p, getpath
+from concurrent.futures import ThreadPoolExecutor
+from gmadet.utils import mv_p, getpath, get_header, split_filename
 
 def sextractor_command(
         config,
@@ -49,6 +49,7 @@ def sextractor_command(
             "-VERBOSE_TYPE", verbose,
             "-PSF_NAME", psfs,
             "-CATALOG_NAME", catname,
+            "-CATALOG_TYPE", "FITS_LDAC",
             "-FILTER_NAME", config["sextractor"]["convFilter"]
         ])
 
@@ -101,13 +102,7 @@ def run_sextractor(filelist, FWHM_list, thresh, telescope, config,
 
     args = []
     for i, filename in enumerate(filelist):
-        path, filename_ext = os.path.split(filename)
-        if path:
-            folder = path + "/"
-        else:
-            folder = ""
-        #  Get rid of the extension to keep only the name
-        filename2 = os.path.splitext(filename_ext)[0]
+        folder, filename2, _ = split_filename(filename)
         if outLevel == 2:
             checkimage_type = "BACKGROUND, SEGMENTATION"
             checkimage_name = (
@@ -137,9 +132,11 @@ def run_sextractor(filelist, FWHM_list, thresh, telescope, config,
             psfs[i],
             folder + filename2 + "_SourcesDet.cat",
             ])
-    p = Pool(nb_threads)
-    p.starmap(sextractor_command, args)
-    p.close()
+    # sextractor runs as an external process writing its own catalog,
+    # so threads are enough to run several of them at once.
+    nb_threads = max(1, min(nb_threads, len(args)))
+    with ThreadPoolExecutor(max_workers=nb_threads) as executor:
+        list(executor.map(lambda arg: sextractor_command(*arg), args))
     
 def filter_sources(filelist, soft, edge_cut=32, sigma=1, subFiles=None):
     # if substraction have been performed
@@ -162,17 +159,13 @@ def filter_sources(filelist, soft, edge_cut=32, sigma=1, subFiles=None):
         filelist.extend([im for im in subfiles[:, 2]])
         """
     for filename in filelist:
-        path, filename_ext = os.path.split(filename)
-        if path:
-            folder = path + "/"
-        else:
-            folder = ""
-        #  Get rid of the extension to keep only the name
-        filename2,fileext = os.path.splitext(filename_ext)
+        folder, filename2, fileext = split_filename(filename)
 
         if soft == "sextractor":
-            sources = ascii.read(
-                folder + filename2 + "_SourcesDet.cat", format="sextractor"
+            sources = Table.read(
+                folder + filename2 + "_SourcesDet.cat",
+                format="fits",
+                hdu="LDAC_OBJECTS"
             )
             mv_p(
                 folder + filename2 + "_SourcesDet.cat",
@@ -181,7 +174,7 @@ def filter_sources(filelist, soft, edge_cut=32, sigma=1, subFiles=None):
             #  only if there is at least one detection
             if sources:
                 #  Remove sources too close to the imge edges
-                header = fits.getheader(folder + filename2 + fileext)
+                header = get_header(folder + filename2 + fileext)
                 imsize = [int(header["NAXIS1"]), int(header["NAXIS2"])]
                 mask_edge = (
                     (sources["X_IMAGE"] > edge_cut)
@@ -219,24 +212,22 @@ def filter_sources(filelist, soft, edge_cut=32, sigma=1, subFiles=None):
                 # sources_filt = sources[mask_edge]
                 # Flag sources too close to the edges
                 #  Only if there is at least one detection
-                edge_flag = np.array(["N"] * len(sources))
-                edge_flag[~mask_edge] = "Y"
-                sources["edge"] = edge_flag
+                sources["edge"] = np.where(mask_edge, "N", "Y")
             else:
                 #  Add something to make script not crashing
                 sources["edge"] = []
             sources.write(
                 folder + filename2 + "_SourcesDet.cat",
-                format="ascii.commented_header",
+                format="fits",
                 overwrite=True,
             )
 
 
 def convert_xy_radec(filelist, soft="sextractor", subFiles=None):
     """
-    Performs pyraf transformation of x-y into RA-DEC coordinates
-    filename is WITHOUT suffix .fits
-    Input is the *.magfiltered file from select_good_stars() function
+    Transform x-y into RA-DEC coordinates with astropy WCS,
+    one vectorised call per image.
+    Input is the *_SourcesDet.cat file from filter_sources()
     Output is the *.magwcs file
     """
     # If substraction has been performed
@@ -270,21 +261,14 @@ def convert_xy_radec(filelist, soft="sextractor", subFiles=None):
     for filename, original_filename, refimage in zip(
         filelist, original_filelist, reference_filelist
     ):
-        path, filename_ext = os.path.split(filename)
-        if path:
-            folder = path + "/"
-        else:
-            folder = ""
-
-        #  Get rid of the extension to keep only the name
-        filename2 = os.path.splitext(filename_ext)[0]
+        folder, filename2, _ = split_filename(filename)
 
         magfilewcs = folder + filename2 + ".magwcs"
 
         if soft == "sextractor":
-            sources = ascii.read(
+            sources = Table.read(
                 folder + filename2 + "_SourcesDet.cat",
-                format="commented_header"
+                format="fits"
             )
             #  If there is at least one detection
             if sources:
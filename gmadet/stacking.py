@@ -79,7 +79,8 @@ def table_obs(path_data, radius, deltaT, exclude=None):
     filters = []
     for ima in filenames:
         # print("processing " + ima + " ...\x1b[2K", end='\r', flush=True),
-        hdr = fits.open(ima, memmap=False)[0].header
+        # Only the header is needed, do not load the pixel data
+        hdr = fits.getheader(ima)
         #  Get time of observation in hours
         try:
             date = time.Time(hdr["DATE-OBS"], format="fits")
@@ -11,6 +11,7 @@ import subprocess
 import sys
 import importlib
 import time
+import xml.etree.ElementTree as ET
 import numpy as np
 import matplotlib.pyplot as plt
 
@@ -30,7 +31,13 @@ from astropy.visualization import (
     ImageNormalize,
     ZScaleInterval,
 )
-from copy import deepcopy
+
+# fitsio is optional. It is much faster than astropy when only the
+# header of a fits file is needed.
+try:
+    import fitsio
+except ImportError:
+    fitsio = None
 
 
 def cp_p(src, dest):
@@ -77,6 +84,75 @@ def getpath():
     return path
 
 
+def split_filename(filename):
+    """Split a filename into folder, name without extension and extension.
+    The folder ends with '/' or is an empty string for the current one,
+    so that folder + name + suffix gives a valid path.
+    """
+    path, filename_ext = os.path.split(filename)
+    if path:
+        folder = path + "/"
+    else:
+        folder = ""
+    name, extension = os.path.splitext(filename_ext)
+
+    return folder, name, extension
+
+
+def get_header(filename):
+    """Read the primary header of a fits file.
+    Use fitsio if installed, astropy otherwise.
+    Only meant for keyword access, use astropy for anything else (WCS...)
+    """
+    if fitsio is not None:
+        return fitsio.read_header(filename, ext=0)
+    else:
+        return fits.getheader(filename)
+
+
+# Header keywords giving the pixel scale, in order of preference
+PIXSCALE_KEYS = ("CDELT1", "_DELT1", "CD1_1")
+
+
+def get_pixscale(header):
+    """Get the pixel scale in degrees from a fits header"""
+    # Test the keywords instead of relying on exceptions.
+    for key in PIXSCALE_KEYS:
+        if key in header:
+            return abs(float(header[key]))
+
+    print(
+        "Pixel scale could not be found in fits header.\n"
+        "Expected keyword: CDELT1, _DELT1 or CD1_1"
+    )
+    raise KeyError("No pixel scale keyword in fits header.")
+
+
+def get_xml_fields(xmlfile):
+    """Get the values of the first row of the first table in the
+    metadata resource of the XML file written by astromatic softs
+    (psfex, scamp).
+    Equivalent to:
+    doc['VOTABLE']['RESOURCE']['RESOURCE']['TABLE'][0]['DATA'][
+        'TABLEDATA']['TR']['TD']
+    with xmltodict, without converting the whole VOTable to dicts.
+    """
+
+    def child(elem, name):
+        """First child with the given tag, whatever the namespace"""
+        for _elem in elem:
+            if _elem.tag.rsplit("}", 1)[-1] == name:
+                return _elem
+        raise KeyError("No %s element found in %s." % (name, xmlfile))
+
+    elem = ET.parse(xmlfile).getroot()
+    for name in ["RESOURCE", "RESOURCE", "TABLE", "DATA", "TABLEDATA", "TR"]:
+        elem = child(elem, name)
+
+    # xmltodict strips whitespaces around the text, do the same
+    return [td.text.strip() if td.text else td.text for td in elem]
+
+
 def getTel():
     """Get the list of all telescopes"""
     path_gmadet = getpath()
@@ -316,7 +392,16 @@ def cut_image(filename, config, Nb_cuts=(2, 2), doAstrometry="scamp"):
 
             scamp(filename, config, accuracy=0.5, itermax=3, verbose="QUIET")
 
-        data, header = fits.getdata(filename, header=True)
+        # Read each quadrant through .section, so that the whole image
+        # is never loaded in memory at once.
+        # Do not force memmap=True: astropy then refuses to read images
+        # with BSCALE/BZERO/BLANK keywords, e.g. uint16 raw frames.
+        hdulist = fits.open(filename)
+        section = hdulist[0].section
+        header = hdulist[0].header.copy()
+        # .section returns scaled values, as fits.getdata did
+        header.remove("BSCALE", ignore_missing=True)
+        header.remove("BZERO", ignore_missing=True)
         w = wcs.WCS(header)
         Naxis1 = header["NAXIS1"]
         Naxis2 = header["NAXIS2"]
@@ -344,8 +429,8 @@ def cut_image(filename, config, Nb_cuts=(2, 2), doAstrometry="scamp"):
                 # No need to update the header if astrometric calibration is
                 # performed with scamp, this will be updated later.
                 # datacut = data[x1-1:x2-1,y1-1:y2-1]
-                datacut = data[y1 - 1: y2 - 1, x1 - 1: x2 - 1]
-                newheader = deepcopy(header)
+                datacut = section[y1 - 1: y2 - 1, x1 - 1: x2 - 1]
+                newheader = header.copy()
                 """
                 #Set center center of quadrant as CRPIX1,2
                 #And compute the RA, Dec at this position for CRVAL1,2
@@ -378,6 +463,8 @@ def cut_image(filename, config, Nb_cuts=(2, 2), doAstrometry="scamp"):
                 quadrant_list.append(filename_out)
                 quadrant_ID.append("Q%d_%d_%d" % (index, i, j))
 
+        hdulist.close()
+
     image_table = Table([quadrant_list, quadrant_ID],
                         names=["filenames", "quadrant"])
 
@@ -437,6 +524,10 @@ def make_sub_image(filenames,
     size_list = []
     pixref = []
     origin = []
+    # Many cutouts usually come from the same few images, so open each
+    # image and build its WCS only once.
+    hdulists = []
+    images = {}
 
     for fname, coords, _type, size, FoV in zip(
             filenames,
@@ -445,10 +536,20 @@ def make_sub_image(filenames,
             sizes,
             FoVs):
         # Load file
-        data, header = fits.getdata(fname, header=True)
-        headers.append(header)
+        if fname not in images:
+            # Cutouts are read through .section, so that only their
+            # pixels are loaded. Do not force memmap=True, see cut_image().
+            hdulist = fits.open(fname)
+            hdulists.append(hdulist)
+            header = hdulist[0].header.copy()
+            # .section returns scaled values, as fits.getdata did
+            header.remove("BSCALE", ignore_missing=True)
+            header.remove("BZERO", ignore_missing=True)
+            images[fname] = (hdulist[0].section, header, WCS(header))
+        data, header, w = images[fname]
+        # Headers are modified afterwards when writing the cutouts
+        headers.append(header.copy())
         # Get physical coordinates of OT
-        w = WCS(header)
         if _type == "world":
             # Get physical coordinates
             c = coord.SkyCoord(
@@ -468,10 +569,7 @@ def make_sub_image(filenames,
 
         if FoV > 0:
             # Get pixel size in degrees
-            try:
-                pixSize = abs(float(header["CDELT1"]))
-            except BaseException:
-                pixSize = abs(float(header["CD1_1"]))
+            pixSize = get_pixscale(header)
             # Compute number of pixels to reach desired FoV in arcseconds
             size = [int(FoV / (pixSize * 3600)), int(FoV / (pixSize * 3600))]
 
@@ -494,6 +592,10 @@ def make_sub_image(filenames,
             origin.append("upper")
         else:
             origin.append("lower")
+
+    for hdulist in hdulists:
+        hdulist.close()
+
     return [subimages, headers, size_list, pixref, origin]
 
 
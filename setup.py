@@ -30,7 +30,6 @@ requirements = [
         'lacosmic',
         'hjson',
         'voevent-parse',
-        'xmltodict',
         'astroML',
         'photutils',
         'keras',
@@ -48,6 +47,11 @@ setup_requirements = [
         'wheel',
         'twine']
 
+# Optional dependencies, installed with: pip install gmadet[fast]
+extras_requirements = {
+        'fast': ['fitsio'],
+       }
+
 test_requirements = [
         'pytest',
         'pytest-cov',
@@ -90,6 +94,7 @@ setup(
         ],
     },
     install_requires=requirements,
+    extras_require=extras_requirements,
     license="MIT license",
     long_description=readme,
     long_description_content_type='text/markdown',
@@ -3,7 +3,10 @@
 
 """Tests for `gmadet` package."""
 
+import shutil
 import pytest
+import numpy as np
+from astropy.io import fits
 from gmadet.cli.psf import main as gmadet_psf
 
 
@@ -85,6 +88,69 @@ def test_gmadet_run_noSub(script_runner):
     # assert ret.stderr == ''
 
 
+def test_gmadet_run_local_crossmatch(script_runner, tmp_path):
+    "test gmadet-run crossmatching catalogs locally."
+    ret = script_runner.run(
+        'gmadet-run',
+        'gmadet/data_test/test_image.fits',
+        '--results', str(tmp_path / 'gmadet_results'),
+        '--telescope', 'IRIS',
+        '--fwhm', 'psfex',
+        '--astrometry', 'scamp',
+        '--radius-crossmatch', '3',
+        '--threshold', '4',
+        '--crossmatch-method', 'local',
+    )
+    assert ret.success
+
+
+def test_gmadet_run_nproc(script_runner, tmp_path):
+    "test gmadet-run processing two images in parallel."
+    filenames = []
+    for i in range(2):
+        filename = str(tmp_path / ('test_image_%d.fits' % i))
+        shutil.copy('gmadet/data_test/test_image.fits', filename)
+        filenames.append(filename)
+
+    ret = script_runner.run(
+        'gmadet-run',
+        *filenames,
+        '--results', str(tmp_path / 'gmadet_results'),
+        '--telescope', 'IRIS',
+        '--fwhm', 'psfex',
+        '--astrometry', 'scamp',
+        '--radius-crossmatch', '3',
+        '--threshold', '4',
+        '--nproc', '2',
+    )
+    assert ret.success
+
+
+def test_gmadet_run_uint16_quadrants(script_runner, tmp_path):
+    "test gmadet-run on a raw uint16 image (BZERO=32768) cut in quadrants."
+    data, header = fits.getdata('gmadet/data_test/test_image.fits',
+                                header=True)
+    del header['BSCALE']
+    del header['BZERO']
+    data = np.clip(data, 0, 65535).astype(np.uint16)
+    filename = str(tmp_path / 'test_image_uint16.fits')
+    # astropy writes uint16 data as int16 with BZERO=32768
+    fits.writeto(filename, data, header)
+
+    ret = script_runner.run(
+        'gmadet-run',
+        filename,
+        '--results', str(tmp_path / 'gmadet_results'),
+        '--telescope', 'IRIS',
+        '--fwhm', 'psfex',
+        '--astrometry', 'no',
+        '--quadrants', '2',
+        '--radius-crossmatch', '3',
+        '--threshold', '4',
+    )
+    assert ret.success
+
+
 def test_gmadet_run_Sub_individual(script_runner):
     "test gmadet-run with substraction."
     ret = script_runner.run(